@@ -1,6 +1,9 @@
 # Contains a unified class definition for a document.
 
 class Document(object):
+    # Fixed set of attributes: saves the per-instance __dict__. Also the fields stored in the JSON collection file.
+    __slots__ = ('document_id', 'title', 'raw_text', 'terms', 'filtered_terms', 'stemmed_terms')
+
     def __init__(self):
         self.document_id = None  # Unique document ID
         self.title = ''  # Title of document
@@ -1,9 +1,51 @@
 # Contains functions that deal with the extraction of documents from a text file (see PR01)
 
 import json
-import re
+import string
+import sys
+from operator import attrgetter
 from document import Document
 
+try:
+    # orjson is much faster than the standard library, but optional.
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    _json_loads = json.loads
+
+
+# Fables are separated from each other by three blank lines, titles from their text by two.
+FABLE_SEPARATOR = '\n\n\n\n'
+TITLE_SEPARATOR = '\n\n\n'
+READ_CHUNK_SIZE = 64 * 1024
+# Maps all punctuation except "_" (a word character) to spaces. For ASCII text, splitting the translated text yields
+# the same terms as re.findall(r'\b\w+\b', ...), without running the regex engine.
+_PUNCTUATION_TABLE = str.maketrans({c: ' ' for c in string.punctuation if c != '_'})
+_get_document_fields = attrgetter(*Document.__slots__)
+# Fields that hold term lists. Their terms are interned, so every occurrence of a term in the collection shares one
+# string object, and lookups of the same term compare by identity first.
+_TERM_FIELDS = ('terms', 'filtered_terms', 'stemmed_terms')
+
+
+def _read_entries(file, separator: str):
+    """
+    Reads a text file chunk by chunk and yields the parts between the separators, so that only one part has to be held
+    in memory at a time. Yields exactly the same parts as file.read().split(separator).
+    :param file: File object opened in text mode
+    :param separator: Separator between the parts
+    :return: Generator of the parts of the file
+    """
+    remainder = ''
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), ''):
+        *entries, remainder = (remainder + chunk).split(separator)
+        yield from entries
+    yield remainder
+
 
 def extract_collection(source_file_path: str) -> list[Document]:
     """
@@ -12,39 +54,25 @@ def extract_collection(source_file_path: str) -> list[Document]:
     :return: List of Document objects
     """
     catalog = []  # This dictionary will store the document raw_data.
-    fables = ""
     current_document_id = 0
-    title = "The Cock and the Pearl"
     # TODO: Implement this function. (PR02)
     # raise NotImplementedError('Not implemented yet!')
 
-    with open(source_file_path, 'r') as file:
-        lines = file.read()
-
-    inside_fable = False  # parse flag
-    for line in lines.split('\n'):
-        line = line.strip()
-        if line == title:
-            inside_fable = True
-
-        if inside_fable == True:
-            fables += line
-
-    fables_entries = lines.split('\n\n\n\n')
-
-    for i,entry in enumerate(fables_entries):
-        if i > 1:
-            lines=entry.split('\n\n\n')
-            document = Document()
+    with open(source_file_path, 'r', encoding='utf-8', buffering=READ_CHUNK_SIZE) as file:
+        # The first two entries are the Project Gutenberg header and the table of contents.
+        for i, entry in enumerate(_read_entries(file, FABLE_SEPARATOR)):
+            if i > 1:
+                lines = entry.split(TITLE_SEPARATOR)
+                document = Document()
 
-            document.document_id = current_document_id
-            document.title = lines[0]
-            document.raw_text = lines[1]
-            document.terms = re.findall(r'\b\w+\b', lines[1].lower())
-            document.filtered_terms = []
+                document.document_id = current_document_id
+                document.title = lines[0]
+                document.raw_text = lines[1]
+                document.terms = list(map(sys.intern, lines[1].translate(_PUNCTUATION_TABLE).lower().split()))
+                document.filtered_terms = []
 
-            catalog.append(document)
-            current_document_id += 1
+                catalog.append(document)
+                current_document_id += 1
 
     return catalog
 
@@ -55,19 +83,10 @@ def save_collection_as_json(collection: list[Document], file_path: str) -> None:
     :param collection: The collection to store (= a list of Document objects)
     :param file_path: Path of the JSON file
     """
-    serializable_collection = []
-    for doc in collection:
-        serializable_collection.append({
-            'document_id': doc.document_id,
-            'title': doc.title,
-            'raw_text': doc.raw_text,
-            'terms': doc.terms,
-            'filtered_terms': doc.filtered_terms,
-            'stemmed_terms': doc.stemmed_terms
-        })
+    serializable_collection = [dict(zip(Document.__slots__, _get_document_fields(doc))) for doc in collection]
 
-    with open(file_path, "w") as json_file:
-        json.dump(serializable_collection, json_file)
+    with open(file_path, "wb") as json_file:
+        json_file.write(_json_dumps(serializable_collection))
 
 
 def load_collection_from_json(file_path: str) -> list[Document]:
@@ -77,18 +96,18 @@ def load_collection_from_json(file_path: str) -> list[Document]:
     :return: list of Document objects
     """
     try:
-        with open(file_path, "r") as json_file:
-            json_data = json.load(json_file)
+        with open(file_path, "rb", buffering=READ_CHUNK_SIZE) as json_file:
+            json_data = _json_loads(json_file.read())
 
         collection = []
         for item in json_data:
             doc = Document()
-            doc.document_id = item.get('document_id')
-            doc.title = item.get('title')
-            doc.raw_text = item.get('raw_text')
-            doc.terms = item.get('terms')
-            doc.filtered_terms = item.get('filtered_terms')
-            doc.stemmed_terms = item.get('stemmed_terms')
+            for field in Document.__slots__:
+                setattr(doc, field, item.get(field))
+            for field in _TERM_FIELDS:
+                terms = getattr(doc, field)
+                if terms:
+                    setattr(doc, field, list(map(sys.intern, terms)))
             collection.append(doc)
 
         return collection
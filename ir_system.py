@@ -16,9 +16,12 @@
 # Good luck!
 
 
+import heapq
 import json
 import os
 import time
+from itertools import islice
+from operator import itemgetter
 
 import cleanup
 import extraction
@@ -52,17 +55,22 @@ class InformationRetrievalSystem(object):
             print('No previous collection was found. Creating empty one.')
             self.collection = []
 
-        # Stopword list, initially empty.
+        # Stopword list, initially empty. Kept as a frozenset for constant-time membership tests.
         try:
             with open(STOPWORD_FILE_PATH, 'r') as f:
-                self.stop_word_list = json.load(f)
+                self.stop_word_list = frozenset(json.load(f))
         except FileNotFoundError:
             print('No stopword list was found.')
-            self.stop_word_list = []
+            self.stop_word_list = frozenset()
 
         self.model = None  # Saves the current IR model in use.
+        self._repr_cache_model = None  # Model that the cached document representations belong to.
+        self._indexed_model = None  # Model that the collection was last added to, see _index_collection().
+        self._indexed_params = None  # (stop_word_filtering, stemming) used for that model.
+        self._collection_changed()
         self.output_k = 5  # Controls how many results should be shown for a query.
         self.ground_truth = self.load_ground_truth(GROUND_TRUTH_PATH)  # Load ground truth data
+        self._relevance_cache = {}  # Normalized query -> relevant document IDs, see _relevant_doc_ids().
 
     def main_menu(self):
         """
@@ -142,9 +150,10 @@ class InformationRetrievalSystem(object):
                 self.collection = extraction.extract_collection(raw_collection_file)
                 assert isinstance(self.collection, list)
                 assert all(isinstance(d, Document) for d in self.collection)
+                self._collection_changed()
 
                 if input('Should stopwords be filtered? [y/N]: ') == 'y':
-                    cleanup.filter_collection(self.collection)
+                    cleanup.filter_collection(self.collection, self.stop_word_list)
 
                 if input('Should stemming be performed? [y/N]: ') == 'y':
                     porter.stem_all_documents(self.collection)
@@ -171,7 +180,8 @@ class InformationRetrievalSystem(object):
 
                     # Save new stopword list into file:
                     with open(STOPWORD_FILE_PATH, 'w') as f:
-                        json.dump(self.stop_word_list, f)
+                        json.dump(sorted(self.stop_word_list), f)
+                    self._repr_cache = {}
                 else:
                     print('Invalid choice.')
 
@@ -201,15 +211,12 @@ class InformationRetrievalSystem(object):
 
             elif action_choice == CHOICE_SHOW_DOCUMENT:
                 target_id = int(input('ID of the desired document:'))
-                found = False
-                for document in self.collection:
-                    if document.document_id == target_id:
-                        print(document.title)
-                        print('-' * len(document.title))
-                        print(document.raw_text)
-                        found = True
-
-                if not found:
+                document = self._doc_by_id.get(target_id)
+                if document is not None:
+                    print(document.title)
+                    print('-' * len(document.title))
+                    print(document.raw_text)
+                else:
                     print(f'Document #{target_id} not found!')
 
             elif action_choice == CHOICE_EXIT:
@@ -221,6 +228,53 @@ class InformationRetrievalSystem(object):
             input('Press ENTER to continue...')
             print()
 
+    def _collection_changed(self):
+        """
+        Rebuilds all lookup structures that are derived from self.collection. Must be called whenever the collection
+        is replaced.
+        """
+        self._doc_by_id = {document.document_id: document for document in self.collection}
+        self._repr_cache = {}
+        if self.model is not None and self._indexed_model is self.model:
+            # The model's index still holds the old collection.
+            self.model = type(self.model)()
+        self._indexed_model = None
+
+    def _index_collection(self, stop_word_filtering: bool, stemming: bool):
+        """
+        Adds all documents of the collection to the index of the current model, unless this was already done for the
+        same model and search parameters. A model only indexes the collection for one set of parameters, so a model
+        that was indexed with different parameters is replaced by a fresh instance first.
+        :param stop_word_filtering: Controls, whether stop-words are ignored in the search
+        :param stemming: Controls, whether stemming is used
+        """
+        params = (stop_word_filtering, stemming)
+        if self._indexed_model is self.model:
+            if self._indexed_params == params:
+                return
+            self.model = type(self.model)()
+        for doc in self.collection:
+            self.model.add_document(doc, stop_word_filtering, stemming)
+        self._indexed_model = self.model
+        self._indexed_params = params
+
+    def _document_representations(self, stop_word_filtering: bool, stemming: bool) -> list:
+        """
+        Returns the representations of all documents in the collection for the current model. They only depend on the
+        model, the collection and the search parameters, so they are calculated once and reused by later queries.
+        :param stop_word_filtering: Controls, whether stop-words are ignored in the search
+        :param stemming: Controls, whether stemming is used
+        :return: List of document representations, in the same order as self.collection
+        """
+        if self._repr_cache_model is not self.model:
+            self._repr_cache = {}
+            self._repr_cache_model = self.model
+        key = (stop_word_filtering, stemming)
+        if key not in self._repr_cache:
+            self._repr_cache[key] = [self.model.document_to_representation(d, stop_word_filtering, stemming)
+                                     for d in self.collection]
+        return self._repr_cache[key]
+
     def basic_query_search(self, query: str, stemming: bool, stop_word_filtering: bool) -> list:
         """
         Searches the collection for a query string. This method is "basic" in that it does not use any special algorithm
@@ -233,11 +287,9 @@ class InformationRetrievalSystem(object):
         document
         """
         query_representation = self.model.query_to_representation(query)
-        document_representations = [self.model.document_to_representation(d, stop_word_filtering, stemming)
-                                    for d in self.collection]
-        scores = [self.model.match(dr, query_representation) for dr in document_representations]
-        ranked_collection = sorted(zip(scores, self.collection), key=lambda x: x[0], reverse=True)
-        results = ranked_collection[:self.output_k]
+        document_representations = self._document_representations(stop_word_filtering, stemming)
+        scores = self.model.match_all(document_representations, query_representation)
+        results = heapq.nlargest(self.output_k, zip(scores, self.collection), key=itemgetter(0))
         return results
 
     def inverted_list_search(self, query: str, stemming: bool, stop_word_filtering: bool) -> list:
@@ -250,14 +302,13 @@ class InformationRetrievalSystem(object):
         document
         """
         # TODO: Implement this function (PR03)
-        for doc in self.collection:
-            self.model.add_document(doc, stop_word_filtering, stemming)
+        self._index_collection(stop_word_filtering, stemming)
         query_representation = self.model.query_to_representation(query)
-        document_representations = [self.model.document_to_representation(d, stop_word_filtering, stemming) for
-                                    d in self.collection]
-        scores = [self.model.match(dr, query_representation) for dr in document_representations]
-        ranked_collection = sorted(zip(scores, self.collection), key=lambda x: x[0], reverse=True)
-        return ranked_collection[:5]
+
+        # The query is evaluated once on the index; the model's documents are in the order of the collection
+        matching = self.model.match_query(query_representation)
+        results = [(1.0, self.collection[i]) for i in islice(matching, self.output_k)]
+        return self._fill_up_results(results)
 
     def buckley_lewit_search(self, query: str, stemming: bool, stop_word_filtering: bool) -> list:
         """
@@ -269,17 +320,27 @@ class InformationRetrievalSystem(object):
         document
         """
         # TODO: Implement this function (PR04)
-        for doc in self.collection:
-            self.model.add_document(doc, stop_word_filtering, stemming)
+        self._index_collection(stop_word_filtering, stemming)
 
         query_representation = self.model.query_to_representation(query)
-        document_representations = [self.model.document_to_representation(d, stop_word_filtering, stemming)
-                                    for d in self.collection]
 
-        # Calculate scores
-        scores = [self.model.match(dr, query_representation) for dr in document_representations]
-        ranked_collection = sorted(zip(scores, self.collection), key=lambda x: x[0], reverse=True)
-        return ranked_collection[:5]
+        # Only the top k documents are scored completely, the others are skipped by the model
+        top_documents = self.model.search_topk(query_representation, self.output_k)
+        results = [(score, self._doc_by_id[doc_id]) for score, doc_id in top_documents]
+        return self._fill_up_results(results)
+
+    def _fill_up_results(self, results: list) -> list:
+        """
+        Fills up the results of a search that only returns matching documents with non-matching documents, in
+        collection order, until there are output_k results. This matches the searches that rank all documents.
+        :param results: List of (score, document) tuples of all matching documents, or the first output_k of them
+        :return: The same list, extended to at most output_k results
+        """
+        if len(results) < self.output_k:
+            found = {doc.document_id for _, doc in results}
+            non_matching = ((0.0, d) for d in self.collection if d.document_id not in found)
+            results.extend(islice(non_matching, self.output_k - len(results)))
+        return results
 
     def signature_search(self, query: str, stemming: bool, stop_word_filtering: bool) -> list:
         """
@@ -291,28 +352,23 @@ class InformationRetrievalSystem(object):
         document
         """
         # TODO: Implement this function (PR04)
-        for doc in self.collection:
-            self.model.add_document(doc, stop_word_filtering, stemming)
+        self._index_collection(stop_word_filtering, stemming)
 
-            # Get query representation
+        # Get query representation
         query_representation = self.model.query_to_representation(query)
 
-        # Calculate scores
-        scores = []
-        for doc in self.collection:
-            doc_representation = self.model.document_to_representation(doc, stop_word_filtering, stemming)
-            score = self.model.match(doc_representation, query_representation)
-            scores.append((score, doc))
+        # Calculate scores of all documents in one batch
+        document_representations = self._document_representations(stop_word_filtering, stemming)
+        scores = self.model.match_all(document_representations, query_representation)
 
-        # Sort and return top results
-        ranked_collection = sorted(scores, key=lambda x: x[0], reverse=True)
-        return ranked_collection[:self.output_k]
+        # Select and return top results
+        return heapq.nlargest(self.output_k, zip(scores, self.collection), key=itemgetter(0))
 
     def load_ground_truth(self, ground_truth_path: str) -> dict:
         """
         Load the ground truth data from a file.
         :param ground_truth_path: Path to the ground truth file
-        :return: Dictionary with query terms as keys and sets of relevant document IDs as values
+        :return: Dictionary with lowercase query terms as keys and frozensets of relevant document IDs as values
         """
         ground_truth = {}
         with open(ground_truth_path, 'r') as file:
@@ -322,17 +378,28 @@ class InformationRetrievalSystem(object):
                 parts = line.strip().split(' - ')
                 if len(parts) == 2:
                     query_term, doc_ids_str = parts
-                    doc_ids = set(map(int, doc_ids_str.split(', ')))
-                    ground_truth[query_term] = doc_ids
+                    # int() ignores surrounding whitespace, so IDs may be separated by "," or ", ".
+                    doc_ids = frozenset(map(int, doc_ids_str.split(',')))
+                    ground_truth[query_term.lower()] = doc_ids
         return ground_truth
 
+    def _relevant_doc_ids(self, query: str) -> frozenset[int]:
+        """
+        Determines the IDs of all documents that the ground truth marks as relevant for any term of the query. The
+        result is cached, because both quality metrics need it for every search.
+        :param query: Query string
+        :return: Set of relevant document IDs
+        """
+        query = query.lower()
+        relevant_doc_ids = self._relevance_cache.get(query)
+        if relevant_doc_ids is None:
+            relevant_doc_ids = frozenset().union(*(self.ground_truth.get(term, ()) for term in query.split()))
+            self._relevance_cache[query] = relevant_doc_ids
+        return relevant_doc_ids
+
     def calculate_precision(self, query: str, result_list: list[tuple]) -> float:
         # TODO: Implement this function (PR03)
-        query_terms = query.split()
-        relevant_doc_ids = set()
-        for term in query_terms:
-            relevant_doc_ids.update(self.ground_truth.get(term, set()))
-
+        relevant_doc_ids = self._relevant_doc_ids(query)
         if not relevant_doc_ids:
             return -1
 
@@ -341,15 +408,13 @@ class InformationRetrievalSystem(object):
         if not retrieved_doc_ids:
             return 0.0
 
-        return 1 if len(retrieved_doc_ids) > 0 else 0
+        true_positives = len(retrieved_doc_ids & relevant_doc_ids)
+        precision = true_positives / len(retrieved_doc_ids)
+        return precision
 
     def calculate_recall(self, query: str, result_list: list[tuple]) -> float:
         # TODO: Implement this function (PR03)
-        query_terms = query.split()
-        relevant_doc_ids = set()
-        for term in query_terms:
-            relevant_doc_ids.update(self.ground_truth.get(term, set()))
-
+        relevant_doc_ids = self._relevant_doc_ids(query)
         if not relevant_doc_ids:
             return -1
 
@@ -358,7 +423,7 @@ class InformationRetrievalSystem(object):
         if not retrieved_doc_ids:
             return 0.0
 
-        true_positives = len(retrieved_doc_ids.intersection(relevant_doc_ids))
+        true_positives = len(retrieved_doc_ids & relevant_doc_ids)
         recall = true_positives / len(relevant_doc_ids)
         return recall
 
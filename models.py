@@ -1,14 +1,116 @@
 # Contains all retrieval models.
 
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+from functools import lru_cache, reduce
+from itertools import chain
+from operator import or_
 import re
 import math
 import hashlib
+import heapq
 import random
-import bitarray
 from document import Document
 
+try:
+    # xxHash is a non-cryptographic hash that is much faster than MD5, but optional.
+    import xxhash
+
+    def _hash128(data: bytes, seed: int) -> int:
+        return xxhash.xxh3_128_intdigest(data, seed=seed)
+except ImportError:
+    def _hash128(data: bytes, seed: int) -> int:
+        return int.from_bytes(hashlib.md5(str(seed).encode() + data).digest(), 'little')
+
+_EMPTY_POSTINGS = (array('i'), array('f'))
+
+# Number of query results an InvertedListBooleanModel keeps cached.
+RESULT_CACHE_SIZE = 1024
+
+_BOOLEAN_QUERY_TOKEN_RE = re.compile(r'\(|\)|\w+|&|\||-')
+
+
+def _tokenize_boolean_query(query: str) -> tuple[str, ...]:
+    """
+    Splits a Boolean query into terms, operators and parentheses.
+    :param query: Query string
+    :return: Tuple of lower case tokens
+    """
+    return tuple(_BOOLEAN_QUERY_TOKEN_RE.findall(query.lower()))
+
+
+# Node kinds of a compiled Boolean query, see _compile_boolean_query().
+_TERM, _NOT, _AND, _OR = range(4)
+_BINARY_OPERATORS = {'&': _AND, '|': _OR}
+
+
+@lru_cache(maxsize=1024)
+def _compile_boolean_query(query: str):
+    """
+    Parses a Boolean query into a tree of nested tuples, so that evaluating it does not involve the query string or
+    its tokens any more. Cached, since the same query is usually parsed once per search; the tree is immutable, so the
+    shared cached value cannot be modified by the caller and can be used as a dict key. Nodes are (_TERM, term),
+    (_NOT, term), (_AND, left, right) and (_OR, left, right). Operators are applied from left to right without
+    precedence; parentheses group sub-expressions. Operators without an operand on both sides are ignored.
+    :param query: Query string
+    :return: Root node, or None for a query without terms
+    """
+    tree, _ = _parse_boolean_tokens(_tokenize_boolean_query(query), 0)
+    return tree
+
+
+def _parse_boolean_tokens(tokens, pos):
+    """
+    Parses the tokens from position pos up to the closing bracket of the current sub-expression (or the end).
+    :param tokens: Query tokens
+    :param pos: Index of the first token to parse
+    :return: Tuple of the root node of the sub-expression and the position after the last consumed token
+    """
+    items = []  # Operands and operator kinds in query order
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token == '(':
+            sub_tree, pos = _parse_boolean_tokens(tokens, pos)
+            items.append(sub_tree)
+        elif token == ')':
+            break
+        elif token in _BINARY_OPERATORS:
+            items.append(_BINARY_OPERATORS[token])
+        elif token == '-':
+            if pos < len(tokens):
+                items.append((_NOT, tokens[pos]))
+                pos += 1
+        else:
+            items.append((_TERM, token))
+
+    tree = None
+    operator = None
+    for item in items:
+        if isinstance(item, int):
+            operator = item
+            continue
+        if item is None:
+            continue  # Empty sub-expression
+        if tree is None:
+            tree = item
+        elif operator is not None:
+            tree = (operator, tree, item)
+        operator = None
+    return tree, pos
+
+
+def _set_bits(bitmap: int) -> list[int]:
+    """
+    Returns the positions of all set bits of a bitmap held in a Python int.
+    :param bitmap: Bitmap
+    :return: Ascending list of bit positions
+    """
+    bits = bin(bitmap)[:1:-1]
+    return [position for position, bit in enumerate(bits) if bit == '1']
+
 
 class RetrievalModel(ABC):
     @abstractmethod
@@ -43,14 +145,44 @@ class RetrievalModel(ABC):
         """
         raise NotImplementedError()
 
+    def match_all(self, document_representations: list, query_representation) -> list[float]:
+        """
+        Matches the query representation against all given document representations at once. The default simply calls
+        match() for each document; models can override this with a faster batch implementation.
+        :param document_representations: Data that describes the documents
+        :param query_representation: Data that describes a query
+        :return: List of scores, in the same order as document_representations
+        """
+        return [self.match(dr, query_representation) for dr in document_representations]
+
+    def _representation_postings(self, document_representations: list) -> dict[str, list[int]]:
+        """
+        Builds postings from document representations that are collections of terms. They are kept until match_all()
+        is called with other representations; an equal list, e.g. from another search mode for a model ignoring the
+        search parameters, is compared instead of indexed again. Models using this set self._postings and
+        self._indexed_representations in __init__().
+        :param document_representations: Data that describes the documents
+        :return: Term -> ascending indices of the documents containing it
+        """
+        if document_representations is not self._indexed_representations:
+            if document_representations != self._indexed_representations:
+                postings = defaultdict(list)
+                for doc_idx, document_representation in enumerate(document_representations):
+                    for term in document_representation:
+                        postings[term].append(doc_idx)
+                self._postings = postings
+            self._indexed_representations = document_representations
+        return self._postings
+
 
 class LinearBooleanModel(RetrievalModel):
     # TODO: Implement all abstract methods and __init__() in this class. (PR02)
     def __init__(self):
-        pass
+        self._indexed_representations = None  # Document representations that the postings below were built from.
+        self._postings = {}  # Term -> indices of the documents containing it, see _representation_postings().
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
-        return set(document.terms)
+        return frozenset(document.terms)
 
     def query_to_representation(self, query: str):
         return query.lower()
@@ -58,6 +190,15 @@ class LinearBooleanModel(RetrievalModel):
     def match(self, document_representation, query_representation) -> float:
         return 1.0 if query_representation in document_representation else 0.0
 
+    def match_all(self, document_representations: list, query_representation) -> list[float]:
+        # Same result as match() for every document, but the matching documents are looked up in postings, so a query
+        # costs one dict lookup instead of one set lookup per document.
+        postings = self._representation_postings(document_representations)
+        scores = [0.0] * len(document_representations)
+        for doc_idx in postings.get(query_representation, ()):
+            scores[doc_idx] = 1.0
+        return scores
+
     def __str__(self):
         return 'Boolean Model (Linear)'
 
@@ -65,8 +206,15 @@ class LinearBooleanModel(RetrievalModel):
 class InvertedListBooleanModel(RetrievalModel):
     # TODO: Implement all abstract methods and __init__() in this class. (PR03)
     def __init__(self):
-        self.inverted_index = defaultdict(set)
+        # Term -> posting list, stored as a bitmap in a Python int: bit i is set if document i contains the term.
+        # AND, OR and NOT then run word-wise over the whole posting list in C.
+        self.inverted_index = defaultdict(int)
         self.documents = []
+        self._doc_idx = {}  # Representation -> index of the first document added with it.
+        # (Query tree, index version) -> bitmap of matching documents, least recently used first.
+        self._query_cache = OrderedDict()
+        self._index_version = 0  # Incremented whenever a document is added, so cached results of older indexes miss.
+        self._complete_docs = 0  # Bitmap of all added documents, the universe for NOT.
 
     def document_to_representation(self, document: Document, stop_word_filtering=False, stemming=False):
         words = document.terms
@@ -74,53 +222,78 @@ class InvertedListBooleanModel(RetrievalModel):
             words = document.stemmed_terms
         if stop_word_filtering:
             words = document.filtered_terms
-        return set(words)
+        return frozenset(words)
 
     def query_to_representation(self, query):
-        terms = re.findall(r'\(|\)|\w+|&|\||-', query.lower())
-        return terms
+        return _compile_boolean_query(query)
+
+    def match(self, doc_representation, query_tree) -> float:
+        relevant_docs = self._relevant_docs(query_tree)
+        doc_idx = self._doc_idx[doc_representation]
+        return 1.0 if relevant_docs >> doc_idx & 1 else 0.0
 
-    def match(self, doc_representation, query_tokens) -> float:
-        complete_docs = set(range(len(self.documents)))
-        idx = self.inverted_index
-        relevant_docs = self.evaluate_expression(query_tokens[:], idx, complete_docs)
-        doc_idx = self.documents.index(doc_representation)
-        return 1.0 if doc_idx in relevant_docs else 0.0
+    def match_all(self, document_representations: list, query_representation) -> list[float]:
+        relevant_docs = self._relevant_docs(query_representation)
+        doc_idx = self._doc_idx
+        return [1.0 if relevant_docs >> doc_idx[dr] & 1 else 0.0 for dr in document_representations]
+
+    def match_query(self, query_tree) -> list[int]:
+        """
+        Evaluates a query once for the whole index instead of matching document by document.
+        :param query_tree: Query representation
+        :return: Ascending list of the indices of all matching documents, in the order they were added
+        """
+        return _set_bits(self._relevant_docs(query_tree))
+
+    def _relevant_docs(self, query_tree) -> int:
+        """
+        Evaluates a query against the index. The result does not depend on the document being matched, so the results
+        of the RESULT_CACHE_SIZE most recently used queries are cached for the current version of the index.
+        :param query_tree: Query representation
+        :return: Bitmap of the indices of all matching documents
+        """
+        key = (query_tree, self._index_version)
+        relevant_docs = self._query_cache.get(key)
+        if relevant_docs is None:
+            relevant_docs = self.evaluate_expression(query_tree, self.inverted_index, self._complete_docs)
+            self._query_cache[key] = relevant_docs
+            if len(self._query_cache) > RESULT_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        else:
+            self._query_cache.move_to_end(key)
+        return relevant_docs
 
     def add_document(self, doc: Document, filter_stopwords=False, apply_stemming=False):
         doc_rep = self.document_to_representation(doc, filter_stopwords, apply_stemming)
         self.documents.append(doc_rep)
         doc_idx = len(self.documents) - 1
+        self._doc_idx.setdefault(doc_rep, doc_idx)
+        self._index_version += 1
+        doc_bit = 1 << doc_idx
+        self._complete_docs |= doc_bit
         for term in doc_rep:
-            self.inverted_index[term].add(doc_idx)
-
-    def evaluate_expression(self, token_list, idx, complete_docs):
-        evaluation_stack = []
-        while token_list:
-            current_token = token_list.pop(0)
-            if current_token == '(':
-                evaluation_stack.append(self.evaluate_expression(token_list, idx, complete_docs))
-            elif current_token == ')':
-                break
-            elif current_token == '&':
-                evaluation_stack.append('AND')
-            elif current_token == '|':
-                evaluation_stack.append('OR')
-            elif current_token == '-':
-                next_term = token_list.pop(0)
-                evaluation_stack.append(complete_docs - idx.get(next_term, set()))
-            else:
-                evaluation_stack.append(idx.get(current_token, set()))
-
-        expression_result = evaluation_stack.pop(0)
-        while evaluation_stack:
-            operator = evaluation_stack.pop(0)
-            if operator == 'AND':
-                expression_result &= evaluation_stack.pop(0)
-            elif operator == 'OR':
-                expression_result |= evaluation_stack.pop(0)
+            self.inverted_index[term] |= doc_bit
 
-        return expression_result
+    def evaluate_expression(self, query_tree, idx, complete_docs):
+        """
+        Evaluates a compiled query on the inverted index.
+        :param query_tree: Root node of the query, see _compile_boolean_query()
+        :param idx: Inverted index
+        :param complete_docs: Bitmap of all documents
+        :return: Bitmap of the indices of all matching documents
+        """
+        if query_tree is None:
+            return 0
+        kind = query_tree[0]
+        if kind == _TERM:
+            return idx.get(query_tree[1], 0)
+        if kind == _NOT:
+            # Postings are subsets of complete_docs, so the complement is a single XOR. complete_docs & ~postings
+            # would first build the negative int ~postings and then AND it.
+            return complete_docs ^ idx.get(query_tree[1], 0)
+        left = self.evaluate_expression(query_tree[1], idx, complete_docs)
+        right = self.evaluate_expression(query_tree[2], idx, complete_docs)
+        return left & right if kind == _AND else left | right
 
     def __str__(self):
         return 'Boolean Model (Inverted List)'
@@ -133,13 +306,45 @@ class SignatureBasedBooleanModel(RetrievalModel):
         self.D = D
         self.m = 1000  # Optimal size of the signature vector (you might need to optimize this)
         self.documents = []
-        self.signatures = []
-        self.hash_functions = [self._create_hash_function() for _ in range(F)]
-
-    def _create_hash_function(self):
-        """Create a hash function."""
-        return lambda x, seed=random.randint(0, 2 ** 32): int(hashlib.md5((str(seed) + x).encode()).hexdigest(),
-                                                              16) % self.m
+        self.signatures = []  # Block signatures of all documents, in the order they were added.
+        self._block_owner = []  # Block index -> index of the document the block belongs to.
+        self._doc_idx = {}  # Representation -> index of the first document added with it.
+        # Bit-sliced signature file: for each of the m signature bits, a bitmap of the blocks having it set. Built
+        # lazily from self.signatures on the first match after documents were added.
+        self._bit_slices = None
+        self.seed = random.randint(0, 2 ** 32)  # Makes the hash positions differ between model instances.
+        # Per probe i: (i, (i^3 - i) / 6 mod m), the term-independent part of the double hashing in _hash_positions().
+        self._probes = [(i, (i ** 3 - i) // 6 % self.m) for i in range(F)]
+        self._term_codes = {}  # Term -> code, see _term_code(). Terms recur across documents and queries.
+
+    def _hash_positions(self, term: str) -> list[int]:
+        """
+        Determines the F bit positions that a term sets in a signature. Instead of computing F independent hashes, all
+        positions are derived from the two 64-bit halves of a single 128-bit hash (xxHash if installed, MD5 otherwise)
+        by enhanced double hashing (Kirsch & Mitzenmacher): h_i = h1 + i * h2 + (i^3 - i) / 6 (mod m).
+        :param term: Term to hash
+        :return: List of F bit positions in range(self.m)
+        """
+        digest = _hash128(term.encode(), self.seed)
+        m = self.m
+        # Reducing first keeps all intermediate values small, the positions stay the same.
+        h1 = (digest & 0xFFFFFFFFFFFFFFFF) % m
+        h2 = (digest >> 64) % m
+        return [(h1 + i * h2 + cubic) % m for i, cubic in self._probes]
+
+    def _term_code(self, term: str) -> int:
+        """
+        Returns the code of a single term: a bitmap with the bits at all of its hash positions set.
+        :param term: Term to encode
+        :return: Term code as int
+        """
+        code = self._term_codes.get(term)
+        if code is None:
+            code = 0
+            for position in self._hash_positions(term):
+                code |= 1 << position
+            self._term_codes[term] = code
+        return code
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
         if stopword_filtering:
@@ -150,42 +355,118 @@ class SignatureBasedBooleanModel(RetrievalModel):
         if stemming:
             words = document.stemmed_terms
 
-        signature = bitarray.bitarray(self.m)
-        signature.setall(1)
-
-        for term in words:
-            for i, hash_function in enumerate(self.hash_functions):
-                signature[hash_function(term)] = 0
-
-        return signature
+        # Superimposing all terms of a document into one signature of m bits saturates it, so that it matches nearly
+        # every query. Each block of D terms gets its own signature instead. The distinct terms are taken in the order
+        # of their first occurrence, so the blocks do not depend on the hash seed of the Python process.
+        block_terms = tuple(dict.fromkeys(words))
+        words = frozenset(block_terms)
+        blocks = tuple(self._signature(block_terms[i:i + self.D]) for i in range(0, len(block_terms), self.D))
+        return blocks, words
 
     def query_to_representation(self, query: str):
-        terms = query.lower().split()
-        signature = bitarray.bitarray(self.m)
-        signature.setall(1)
-        for term in terms:
-            for i, hash_function in enumerate(self.hash_functions):
-                signature[hash_function(term)] = 0
+        terms = frozenset(query.lower().split())
+        return tuple(map(self._term_code, terms)), terms
 
-        return signature
+    def _signature(self, terms) -> int:
+        """
+        Superimposes the codes of the given terms into one signature. The signature is a bitmap of length self.m held
+        in a Python int, where each term sets the bits chosen by the hash functions.
+        :param terms: Terms to encode
+        :return: Signature as int
+        """
+        return reduce(or_, map(self._term_code, terms), 0)
 
     def match(self, document_representation, query_representation) -> float:
-        return (document_representation & query_representation).count(0) / self.m
+        # A document can only contain a query term if one of its block signatures contains all bits of the term code.
+        # Each test is a single word-wise AND over the bitmaps. Documents passing it for all query terms are verified
+        # against their actual terms, which removes the false drops caused by hash collisions.
+        document_blocks, document_terms = document_representation
+        term_codes, query_terms = query_representation
+        if not query_terms:
+            return 0.0  # Like the other Boolean models, a query without terms matches nothing.
+        for code in term_codes:
+            if not any(block & code == code for block in document_blocks):
+                return 0.0
+        return 1.0 if query_terms <= document_terms else 0.0
+
+    def match_all(self, document_representations: list, query_representation) -> list[float]:
+        # Same test as match(), but the signature test is done for all documents at once on the bit slices. Only the
+        # candidates passing it are verified against their terms.
+        term_codes, query_terms = query_representation
+        if not query_terms:
+            return [0.0] * len(document_representations)
+        candidates = self._candidate_docs(term_codes)
+        doc_idx = self._doc_idx
+        return [1.0 if candidates >> doc_idx[dr] & 1 and query_terms <= dr[1] else 0.0
+                for dr in document_representations]
+
+    def _candidate_docs(self, term_codes) -> int:
+        """
+        Determines all documents that have, for every query term, a block whose signature contains the term code. The
+        blocks containing a code are found by ANDing the bit slices of its bits, which costs one AND over a bitmap of
+        all blocks per bit instead of one AND per block.
+        :param term_codes: Codes of the query terms
+        :return: Bitmap of the indices of all candidate documents
+        """
+        if self._bit_slices is None:
+            self._bit_slices = self._build_bit_slices()
+        bit_slices = self._bit_slices
+        block_owner = self._block_owner
+        all_blocks = (1 << len(self.signatures)) - 1
+        candidates = (1 << len(self.documents)) - 1
+        for code in term_codes:
+            blocks = all_blocks
+            for position in _set_bits(code):
+                blocks &= bit_slices[position]
+                if not blocks:
+                    return 0
+            term_docs = 0
+            for block_idx in _set_bits(blocks):
+                term_docs |= 1 << block_owner[block_idx]
+            candidates &= term_docs
+            if not candidates:
+                break
+        return candidates
+
+    def _build_bit_slices(self) -> list[int]:
+        """
+        Transposes the block signatures into one bitmap of blocks per signature bit.
+        :return: List of m bitmaps
+        """
+        if not self.signatures:
+            return [0] * self.m
+        # The transposition runs in C instead of one Python OR per set bit: every signature becomes a row of m binary
+        # digits, zip() turns the rows into columns, and int() parses each column back into a bitmap. The rows are
+        # reversed so that block 0 ends up as the lowest bit of a column, and the columns, which start with the
+        # highest signature bit, are reversed at the end.
+        rows = [format(signature, f'0{self.m}b') for signature in reversed(self.signatures)]
+        return [int(''.join(column), 2) for column in zip(*rows)][::-1]
 
     def __str__(self):
         return 'Boolean Model (Signatures)'
 
     def add_document(self, doc: Document, filter_stopwords=False, apply_stemming=False):
         doc_rep = self.document_to_representation(doc, filter_stopwords, apply_stemming)
+        doc_idx = len(self.documents)
+        self._doc_idx.setdefault(doc_rep, doc_idx)
         self.documents.append(doc_rep)
+        self.signatures.extend(doc_rep[0])
+        self._block_owner.extend([doc_idx] * len(doc_rep[0]))
+        self._bit_slices = None
 
 
 class VectorSpaceModel(RetrievalModel):
     # TODO: Implement all abstract methods. (PR04)
     def __init__(self):
-        self.inverted_index = defaultdict(lambda: defaultdict(float))
-        self.doc_lengths = defaultdict(float)
+        # Term -> (document IDs, TF-IDF weights divided by the document length): two parallel arrays per term, sorted
+        # by document ID. With the lengths folded in, a cosine score is a dot product divided by the query length.
+        self.inverted_index = {}
+        self.doc_lengths = {}  # Document ID -> Euclidean length of its TF-IDF vector
+        self.idf = {}  # Term -> IDF, as of the last finalize()
         self.documents = []
+        self._term_freqs = {}  # Document ID -> {term: frequency}, collected until finalize() computes the weights.
+        self._max_normalized_weights = {}
+        self._finalized = True
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
         terms = document.terms
@@ -194,63 +475,173 @@ class VectorSpaceModel(RetrievalModel):
         if stopword_filtering:
             terms = document.filtered_terms
 
-        term_freq = defaultdict(int)
-        for term in terms:
-            term_freq[term] += 1
-
-        doc_length = 0
-        for term, freq in term_freq.items():
-            tf_idf = self._tf_idf(term, freq, document)
-            self.inverted_index[term][document.document_id] = tf_idf
-            doc_length += tf_idf ** 2
+        # Counter counts in C in a single pass. Terms are already lower case from extraction, and the document itself
+        # is not modified. Missing terms read as 0.
+        term_freq = Counter(terms)
 
-        self.doc_lengths[document.document_id] = math.sqrt(doc_length)
-        return term_freq
+        # The weights themselves are stored in the index by add_document(), the document ID is needed to find them.
+        return document.document_id, term_freq
 
     def query_to_representation(self, query: str):
-        term_freq = defaultdict(int)
-        terms = query.lower().split()
-        for term in terms:
-            term_freq[term] += 1
-        return term_freq
+        return Counter(query.lower().split())
 
     def match(self, document_representation, query_representation) -> float:
-        score = 0
-        query_length = 0
-        doc_id = list(document_representation.keys())[0] if document_representation else None
-        if doc_id is None:
+        self._ensure_finalized()
+        doc_id, _ = document_representation
+        query_length = self._query_length(query_representation)
+        if query_length == 0 or not self.doc_lengths.get(doc_id):
             return 0.0
 
+        score = 0
+        for term, qtf in query_representation.items():
+            doc_ids, weights = self.inverted_index.get(term, _EMPTY_POSTINGS)
+            i = bisect_left(doc_ids, doc_id)
+            if i < len(doc_ids) and doc_ids[i] == doc_id:
+                score += weights[i] * qtf
+
+        return score / query_length
+
+    def match_all(self, document_representations: list, query_representation) -> list[float]:
+        # Term-at-a-time scoring: the dot products of all documents are accumulated over the posting lists of the
+        # query terms only, so documents that share no term with the query are never touched.
+        self._ensure_finalized()
+        query_length = self._query_length(query_representation)
+        if query_length == 0:
+            return [0.0] * len(document_representations)
+
+        # Each posting list is added to the scores in one pass: the query weight is normalized once per term, and the
+        # first query term only assigns its contributions instead of adding them to zero.
+        accumulators = {}
         for term, qtf in query_representation.items():
-            doc_tf_idf = self.inverted_index[term].get(doc_id, 0)
-            score += doc_tf_idf * qtf
-            query_length += qtf ** 2
+            doc_ids, weights = self.inverted_index.get(term, _EMPTY_POSTINGS)
+            query_weight = qtf / query_length
+            if not accumulators:
+                accumulators = {doc_id: tf_idf * query_weight for doc_id, tf_idf in zip(doc_ids, weights)}
+                continue
+            get_score = accumulators.get
+            for doc_id, tf_idf in zip(doc_ids, weights):
+                accumulators[doc_id] = get_score(doc_id, 0.0) + tf_idf * query_weight
+
+        get_score = accumulators.get
+        return [get_score(doc_id, 0.0) for doc_id, _ in document_representations]
+
+    def search_topk(self, query_representation, k: int) -> list[tuple[float, int]]:
+        """
+        Finds the k documents with the highest cosine similarity to the query with the WAND algorithm (Broder et al.).
+        The posting lists of the query terms are traversed document by document. A document is only scored if the upper
+        bounds of the terms it can contain add up to more than the current k-th best score; all documents in between
+        are skipped by binary search on the posting lists.
+        :param query_representation: Query term frequencies
+        :param k: Number of documents to return
+        :return: List of (score, document ID) tuples of matching documents, best first. Documents with equal scores
+        are ordered by ID and may contain fewer than k entries if fewer documents share a term with the query.
+        """
+        self._ensure_finalized()
+        query_length = self._query_length(query_representation)
+        if query_length == 0 or k <= 0:
+            return []
 
-        query_length = math.sqrt(query_length)
-        doc_length = self.doc_lengths.get(doc_id, 1)
+        # Cursor per query term: [current position, document IDs, weights, query weight, upper bound]
+        cursors = []
+        for term, qtf in query_representation.items():
+            if term in self.inverted_index:
+                doc_ids, weights = self.inverted_index[term]
+                cursors.append([0, doc_ids, weights, qtf, qtf * self._max_normalized_weights[term] / query_length])
+
+        top = []  # Min-heap of (score, -document ID): the weakest result, the latest on ties, is evicted first.
+        threshold = 0.0
+        while True:
+            cursors = [c for c in cursors if c[0] < len(c[1])]
+            cursors.sort(key=lambda c: c[1][c[0]])
+
+            # Pivot: first cursor at which the summed upper bounds could beat the current k-th best score.
+            bound = 0.0
+            pivot = None
+            for i, cursor in enumerate(cursors):
+                bound += cursor[4]
+                if bound > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot][1][cursors[pivot][0]]
+
+            if cursors[0][1][cursors[0][0]] == pivot_doc:
+                # All cursors up to the pivot are on the pivot document: score it completely.
+                score = 0.0
+                for cursor in cursors:
+                    position, doc_ids, weights, qtf, _ = cursor
+                    if doc_ids[position] != pivot_doc:
+                        break
+                    score += weights[position] * qtf
+                    cursor[0] += 1
+                score /= query_length
+                if len(top) < k:
+                    heapq.heappush(top, (score, -pivot_doc))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, -pivot_doc))
+                if len(top) == k:
+                    threshold = top[0][0]
+            else:
+                # Documents before the pivot document cannot make it into the top k: skip them.
+                for cursor in cursors[:pivot]:
+                    cursor[0] = bisect_left(cursor[1], pivot_doc, cursor[0])
+
+        return [(score, -neg_doc_id) for score, neg_doc_id in sorted(top, key=lambda e: (-e[0], -e[1]))]
 
-        return score / (query_length * doc_length)
+    @staticmethod
+    def _query_length(query_representation) -> float:
+        return math.sqrt(sum(qtf ** 2 for qtf in query_representation.values()))
 
-    def _tf_idf(self, term, term_freq, document):
-        # Compute TF-IDF for a term in a document
-        doc_count = len(self.documents)
-        df = len(self.inverted_index[term])
-        idf = math.log((doc_count + 1) / (1 + df)) + 1
-        tf = term_freq
-        return tf * idf
+    def finalize(self):
+        """
+        Computes the TF-IDF weights and document lengths of all added documents. The IDF of a term depends on the whole
+        collection, so this is done once after indexing instead of with the incomplete statistics available while each
+        document is added. Called automatically before matching if documents were added since the last call.
+        """
+        doc_count = len(self._term_freqs)
+        doc_freq = Counter(chain.from_iterable(self._term_freqs.values()))
+        # The IDF only depends on the document frequency, and most terms share one of a few small frequencies, so the
+        # logarithm is computed once per distinct frequency.
+        idf_by_df = {df: math.log((doc_count + 1) / (1 + df)) + 1 for df in set(doc_freq.values())}
+        self.idf = idf = {term: idf_by_df[df] for term, df in doc_freq.items()}
+
+        # Postings are packed into typed arrays: contiguous machine values instead of one boxed Python object per
+        # entry. Single precision is plenty for ranking and halves the memory scanned per query term.
+        self.inverted_index = {term: (array('i'), array('f')) for term in doc_freq}
+        self.doc_lengths = {}
+        for doc_id in sorted(self._term_freqs):
+            tf_idfs = [(term, freq * idf[term]) for term, freq in self._term_freqs[doc_id].items()]
+            doc_length = math.sqrt(sum(tf_idf ** 2 for _, tf_idf in tf_idfs))
+            self.doc_lengths[doc_id] = doc_length
+            for term, tf_idf in tf_idfs:
+                doc_ids, weights = self.inverted_index[term]
+                doc_ids.append(doc_id)
+                weights.append(tf_idf / doc_length)
+        # Largest contribution of each term to a cosine score, used as upper bound by search_topk().
+        self._max_normalized_weights = {term: max(weights) for term, (_, weights) in self.inverted_index.items()}
+        self._finalized = True
+
+    def _ensure_finalized(self):
+        if not self._finalized:
+            self.finalize()
 
     def __str__(self):
         return 'Vector Space Model'
 
     def add_document(self, doc: Document, filter_stopwords=False, apply_stemming=False):
         self.documents.append(doc)
-        self.document_to_representation(doc, filter_stopwords, apply_stemming)
+        doc_id, term_freq = self.document_to_representation(doc, filter_stopwords, apply_stemming)
+        self._term_freqs[doc_id] = term_freq
+        self._finalized = False
 
 
 class FuzzySetModel(RetrievalModel):
     # TODO: Implement all abstract methods. (PR04)
     def __init__(self):
         self.documents = []
+        self._indexed_representations = None  # Document representations that the postings below were built from.
+        self._postings = {}  # Term -> indices of the documents containing it, see _representation_postings().
 
     def document_to_representation(self, document: Document, stopword_filtering=False, stemming=False):
         if stopword_filtering:
@@ -272,5 +663,20 @@ class FuzzySetModel(RetrievalModel):
         union = len(document_representation | query_representation)
         return intersection / union if union > 0 else 0.0
 
+    def match_all(self, document_representations: list, query_representation) -> list[float]:
+        # Only the documents sharing a term with the query have a non-zero intersection, so the intersection sizes
+        # are accumulated term by term from postings instead of intersecting every document set with the query.
+        postings = self._representation_postings(document_representations)
+        intersections = [0] * len(document_representations)
+        for term in query_representation:
+            for doc_idx in postings.get(term, ()):
+                intersections[doc_idx] += 1
+
+        scores = []
+        for document_representation, intersection in zip(document_representations, intersections):
+            union = len(document_representation) + len(query_representation) - intersection
+            scores.append(intersection / union if union > 0 else 0.0)
+        return scores
+
     def __str__(self):
         return 'Fuzzy Set Model'
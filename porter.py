@@ -1,5 +1,6 @@
 # Contains all functions related to the porter stemming algorithm.
 import re
+from functools import lru_cache
 from document import Document
 
 
@@ -47,9 +48,11 @@ def cond_o(stem: str) -> bool:
     return bool(re.search(r'[^aeiou][aeiouy][^aeiouwxy]$', stem))
 
 
+@lru_cache(maxsize=None)
 def stem_term(term: str) -> str:
     """
     Stems a given term of the English language using the Porter stemming algorithm.
+    The result only depends on the term, so it is cached: a collection's vocabulary is much smaller than its term count.
     :param term:
     :return:
     """